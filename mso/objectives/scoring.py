@@ -1,6 +1,8 @@
 """
 Module that defines the ScoringFunction class.
 """
+import sys
+
 import numpy as np
 from scipy.interpolate import interp1d
 from tqdm import tqdm
@@ -86,7 +88,10 @@ class ScoringFunction:
                 curve.
         """
         if self.is_mol_func:
-            outputs = [self.func(mol) for mol in tqdm(input, desc="evaluating scoring function")]
+            # only show the progress bar on a terminal and refresh it at most once per second
+            progress = tqdm(input, desc="evaluating scoring function", disable=not sys.stderr.isatty(),
+                            mininterval=1.0)
+            outputs = [self.func(mol) for mol in progress]
             if self.name == "interactions":
                 scores, residues, hashes = zip(*outputs)
             else:
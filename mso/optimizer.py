@@ -2,10 +2,17 @@
 Module defining the main Particle Swarm optimizer class.
 """
 import time
+import copy
+import heapq
+import itertools
 import json
+import math
+import random
 import numpy as np
 import logging
 import multiprocessing as mp
+import weakref
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import mols2grid
@@ -14,12 +21,38 @@ from loguru import logger
 from rdkit import Chem, rdBase
 from tqdm import tqdm
 
-from mso.swarm import Swarm
-from mso.util import canonicalize_smiles
+from mso.swarm import Swarm, pso_step
+from mso.util import canonicalize_smiles, parse_smiles
 rdBase.DisableLog('rdApp.error')
 logging.getLogger('tensorflow').disabled = True
 
 
+_worker_optimizer = None
+
+
+def _init_worker(optimizer):
+    """
+    Initializer of the worker pool that keeps the optimizer in the worker process, so its state
+    (inference model, scoring functions, caches) is pickled once per worker instead of per task.
+    :param optimizer: The optimizer (without swarms).
+    :return: None
+    """
+    global _worker_optimizer
+    _worker_optimizer = optimizer
+
+
+def _call_worker_optimizer(method_name, swarm, *args):
+    """
+    Worker function that calls a method of the optimizer kept in the worker process.
+    :param method_name: Name of the method that takes a swarm (and additional arguments) and
+        returns the swarm.
+    :param swarm: The swarm passed to the method.
+    :param args: Additional arguments of the method.
+    :return: The updated swarm.
+    """
+    return getattr(_worker_optimizer, method_name)(swarm, *args)
+
+
 class NumpyEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, np.ndarray):
@@ -28,8 +61,6 @@ class NumpyEncoder(json.JSONEncoder):
             return int(obj)
         if isinstance(obj, np.floating):
             return float(obj)
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
         return super(NumpyEncoder, self).default(obj)
     
 
@@ -37,7 +68,11 @@ class BasePSOptimizer:
     """
         Base particle swarm optimizer class. It handles the optimization of a swarm object.
     """
-    def __init__(self, swarms, inference_model, scoring_functions=None, init_smiles_set: set[str] = set()):
+    # particle arrays of the swarms that are kept in stacked arrays, see _stack_swarms
+    _STACKED_ARRAYS = ("x", "v", "particle_best_x", "fitness", "particle_best_fitness")
+
+    def __init__(self, swarms, inference_model, scoring_functions=None, init_smiles_set: set[str] = set(),
+                 num_parse_workers=1):
         """
 
         :param swarms: List of swarm objects each defining an individual particle swarm that
@@ -46,51 +81,131 @@ class BasePSOptimizer:
             Continuous Data-Diven molecular Descriptor (CDDD) space.
         :param scoring_functions: List of functions that are used to evaluate a generated molecule.
             Either take a RDKit mol object as input or a point in the cddd space.
+        :param init_smiles_set: SMILES used to initialise the swarms. Excluded from best_solutions.
+        :param num_parse_workers: Number of processes used to parse and canonicalize new SMILES.
         """
         self.infer_model = inference_model
         self.scoring_functions = scoring_functions
         self.swarms = swarms
-        self.best_solutions = pd.DataFrame(columns=["smiles", "fitness"])
-        self.best_fitness_history = pd.DataFrame(columns=["step", "swarm", "fitness"])
+        # smiles -> fitness of the best solutions, see _update_best_solutions
+        self._best: dict[str, float] = {}
+        self._best_heap: list[tuple[float, str]] = []
+        self._best_fitness_max = -np.inf
+        self._best_solutions_df = None
+        # best solution of each swarm at each step, see _update_best_fitness_history
+        self._history_step: list[int] = []
+        self._history_swarm: list[int] = []
+        self._history_fitness: list[float] = []
+        self._history_smiles: list[str] = []
+        self._best_fitness_history_df = None
 
         self.smi_to_unscaled_scores: dict[str, float] = {}
         self.smi_to_scaled_scores: dict[str, float] = {}
         self.smi_to_desirability_scores: dict[str, float] = {}
         self.smi_to_residues: dict[str, str] = {}
         self.smi_to_hashes: dict[str, str] = {}
+        # unscaled, scaled and desirability scores of each cached SMILES, as rows into one table
+        self._score_rows: dict[str, int] = {}
+        self._score_table = np.empty((3, 0))
         self.init_smiles_set = {canonicalize_smiles(smi) for smi in init_smiles_set}
-
-    def update_fitness(self, swarm):
+        self._smi_canon_cache: dict[str, str] = {}
+        self._mol_cache: dict[str, Chem.Mol] = {}
+        self.num_parse_workers = num_parse_workers
+        self._parse_pool = None
+        self._parse_pool_finalizer = None
+        # processes, not threads: RDKit holds the GIL in MolFromSmiles, so threads parse serially
+        if num_parse_workers > 1:
+            self._parse_pool = ProcessPoolExecutor(num_parse_workers)
+            # shuts the pool down if the optimizer is collected (or at exit) without close()
+            self._parse_pool_finalizer = weakref.finalize(self, self._parse_pool.shutdown)
+        self._stacks: dict[str, np.ndarray] = {}
+
+    def _canonicalize_smiles(self, smiles):
         """
-        Method that calculates and updates the fitness of each particle in  a given swarm. A
-        particles fitness is defined as weighted average of each scoring functions output for
-        this particle.
+        Method that canonicalizes a list of SMILES. Results are memoized for the raw as well as
+        for the canonical SMILES, so decoded SMILES that are already canonical skip RDKit. The
+        RDKit mol objects of not yet scored SMILES are kept until they are scored, so each SMILES
+        is parsed once.
+        :param smiles: List of SMILES.
+        :return: List of canonical SMILES.
+        """
+        new_smis = list(set(smiles).difference(self._smi_canon_cache))
+        if self._parse_pool is not None and len(new_smis) > 1:
+            chunksize = max(1, len(new_smis) // (4 * self.num_parse_workers))
+            parsed = self._parse_pool.map(parse_smiles, new_smis, chunksize=chunksize)
+        else:
+            parsed = map(parse_smiles, new_smis)
+        for smi, (canon, mol) in zip(new_smis, parsed):
+            self._smi_canon_cache[smi] = canon
+            self._smi_canon_cache.setdefault(canon, canon)
+            if canon not in self.smi_to_unscaled_scores:
+                self._mol_cache[canon] = mol
+        return [self._smi_canon_cache[smi] for smi in smiles]
+
+    def _score_new_smiles(self, smiles):
+        """
+        Method that evaluates the scoring functions that take RDKit mol objects on all SMILES
+        that were not scored yet and caches the results.
+        :param smiles: List of canonical SMILES.
+        :return: None
+        """
+        uniq_smis = list(set(smiles).difference(self.smi_to_unscaled_scores))
+        if not uniq_smis:
+            return
+        mol_list = [
+            self._mol_cache.pop(smi) if smi in self._mol_cache else Chem.MolFromSmiles(smi)
+            for smi in uniq_smis
+        ]
+        scores = None
+        for scoring_function in self.scoring_functions:
+            if scoring_function.is_mol_func:
+                unscaled_scores, scaled_scores, desirability_scores, residues, hashes = scoring_function(mol_list)
+                scores = np.array([unscaled_scores, scaled_scores, desirability_scores], dtype=float)
+                unscaled_scores, scaled_scores, desirability_scores = scores.tolist()
+                self.smi_to_unscaled_scores.update(zip(uniq_smis, unscaled_scores))
+                self.smi_to_scaled_scores.update(zip(uniq_smis, scaled_scores))
+                self.smi_to_desirability_scores.update(zip(uniq_smis, desirability_scores))
+                self.smi_to_residues.update(zip(uniq_smis, residues))  # for viz only, not used for optimisation
+                self.smi_to_hashes.update(zip(uniq_smis, hashes))  # for viz only, not used for optimisation
+        if scores is not None:
+            self._add_score_rows(uniq_smis, scores)
+
+    def _add_score_rows(self, smiles, scores):
+        """
+        Method that appends scores to the score table. The table grows by doubling its capacity,
+        so adding rows is amortized constant time per SMILES.
+        :param smiles: List of n SMILES that are not in the score table yet.
+        :param scores: Array (3, n) of the unscaled, scaled and desirability scores.
+        :return: None
+        """
+        start = len(self._score_rows)
+        end = start + len(smiles)
+        if end > self._score_table.shape[1]:
+            table = np.empty((3, max(end, 2 * self._score_table.shape[1])))
+            table[:, :start] = self._score_table[:, :start]
+            self._score_table = table
+        self._score_table[:, start:end] = scores
+        self._score_rows.update(zip(smiles, range(start, end)))
+
+    def _apply_cached_scores(self, swarm):
+        """
+        Method that updates the fitness of each particle in a given swarm. Scores of the scoring
+        functions that take RDKit mol objects are looked up in the cache (see _score_new_smiles),
+        the other scoring functions are evaluated on the particle positions.
         :param swarm: The swarm that is updated.
         :return: The swarm that is updated.
         """
-        assert self.scoring_functions is not None
         weight_sum = 0
         fitness = 0
-
-        swarm.smiles = [canonicalize_smiles(smi) for smi in swarm.smiles]
-
-        uniq_smis = [smi for smi in set(swarm.smiles) if smi not in self.smi_to_unscaled_scores]
-        mol_list = [Chem.MolFromSmiles(sml) for sml in uniq_smis]
+        cached_scores = None
         for scoring_function in self.scoring_functions:
             if scoring_function.is_mol_func:
-                unscaled_scores, scaled_scores, desirability_scores, residues, hashes = scoring_function(mol_list)
-                for smi, unscaled_score, scaled_score, desirability_score, residue, hash in zip(
-                    uniq_smis, unscaled_scores, scaled_scores, desirability_scores, residues, hashes
-                ):
-                    self.smi_to_unscaled_scores[smi] = unscaled_score
-                    self.smi_to_scaled_scores[smi] = scaled_score
-                    self.smi_to_desirability_scores[smi] = desirability_score
-                    self.smi_to_residues[smi] = residue  # for viz only, not used for optimisation
-                    self.smi_to_hashes[smi] = hash  # for viz only, not used for optimisation
                 # remap to full list of scores
-                unscaled_scores = np.array([self.smi_to_unscaled_scores[smi] for smi in swarm.smiles])
-                scaled_scores = np.array([self.smi_to_scaled_scores[smi] for smi in swarm.smiles])
-                desirability_scores = np.array([self.smi_to_desirability_scores[smi] for smi in swarm.smiles])
+                if cached_scores is None:
+                    rows = np.fromiter(
+                        map(self._score_rows.__getitem__, swarm.smiles), dtype=np.intp, count=len(swarm.smiles))
+                    cached_scores = self._score_table[:, rows]
+                unscaled_scores, scaled_scores, desirability_scores = cached_scores
             else:
                 unscaled_scores, scaled_scores, desirability_scores, _ = scoring_function(swarm.x)
 
@@ -103,6 +218,35 @@ class BasePSOptimizer:
         swarm.update_fitness(fitness)
         return swarm
 
+    def update_fitness(self, swarm):
+        """
+        Method that calculates and updates the fitness of each particle in  a given swarm. A
+        particles fitness is defined as weighted average of each scoring functions output for
+        this particle.
+        :param swarm: The swarm that is updated.
+        :return: The swarm that is updated.
+        """
+        assert self.scoring_functions is not None
+        swarm.smiles = self._canonicalize_smiles(swarm.smiles)
+        self._score_new_smiles(swarm.smiles)
+        return self._apply_cached_scores(swarm)
+
+    def _update_fitness_swarms(self):
+        """
+        Method that calculates and updates the fitness of the particles in all swarms. New SMILES
+        are collected over all swarms and scored once, so SMILES that occur in multiple swarms
+        are not evaluated multiple times.
+        :return: The swarms that are updated.
+        """
+        assert self.scoring_functions is not None
+        offsets = np.cumsum([0] + [swarm.num_part for swarm in self.swarms])
+        smiles = self._canonicalize_smiles([smi for swarm in self.swarms for smi in swarm.smiles])
+        self._score_new_smiles(smiles)
+        for swarm, start, end in zip(self.swarms, offsets[:-1], offsets[1:]):
+            swarm.smiles = smiles[start:end]
+            self._apply_cached_scores(swarm)
+        return self.swarms
+
     def _next_step_and_evaluate(self, swarm):
         """
         Method that wraps the update of the particles position (next step) and the evaluation of
@@ -117,31 +261,174 @@ class BasePSOptimizer:
         swarm = self.update_fitness(swarm)
         return swarm
 
-    def _update_best_solutions(self, num_track):
+    def _stack_swarms(self):
         """
-        Method that updates the best_solutions dataframe that keeps track of the overall best
-        solutions over the course of the optimization.
-        :param num_track: Length of the best_solutions dataframe.
-        :return: The max, min and mean fitness of the best_solutions dataframe.
+        Method that keeps the particle arrays (positions, velocities, best positions and fitness)
+        of all swarms in stacked (num_particles, ...) arrays. The arrays of each swarm are views
+        into the stacked arrays, so the in place updates of the swarms directly write into them
+        and the PSO step runs over all particles at once. The positions are a C-contiguous
+        float32 array, the format the inference model consumes. A stacked array is rebuilt if an
+        array of a swarm is not a view into it (e.g. after the swarms were replaced).
+        :return: The offsets of each swarm in the stacked arrays.
         """
-        new_df = pd.DataFrame(columns=["smiles", "fitness", "residues", "hashes"])
-        new_df.smiles = [sml for swarm in self.swarms for sml in swarm.smiles]
-        new_df.fitness = [fit for swarm in self.swarms for fit in swarm.fitness]
-        new_df.residues = [self.smi_to_residues[smi] for smi in new_df.smiles]
-        new_df.hashes = [self.smi_to_hashes[smi] for smi in new_df.smiles]
-
-        # NOTE: remove SMILES which match the SMILES used to initialise the particle swarms
-        new_df = new_df[~new_df.smiles.isin(self.init_smiles_set)]
-
-        self.best_solutions = pd.concat([self.best_solutions, new_df])
-        self.best_solutions = self.best_solutions.drop_duplicates("smiles")
-        self.best_solutions = self.best_solutions.sort_values("fitness", ascending=False).reset_index(drop=True)
-        self.best_solutions = self.best_solutions.iloc[:num_track]
+        offsets = np.cumsum([0] + [swarm.num_part for swarm in self.swarms])
+        for name in self._STACKED_ARRAYS:
+            stack = self._stacks.get(name)
+            if stack is not None and all(getattr(swarm, name).base is stack for swarm in self.swarms):
+                continue
+            dtype = np.float32 if name == "x" else None
+            stack = np.concatenate([getattr(swarm, name) for swarm in self.swarms], dtype=dtype)
+            for swarm, start, end in zip(self.swarms, offsets[:-1], offsets[1:]):
+                setattr(swarm, name, stack[start:end])
+            self._stacks[name] = stack
+        return offsets
+
+    def _next_step_swarms(self, offsets):
+        """
+        Method that updates the particle positions of all swarms (next step) with one PSO step
+        over the stacked arrays. Same update as Swarm.next_step, with the swarm parameters and
+        best positions broadcast to the particles of each swarm.
+        :param offsets: The offsets of each swarm in the stacked arrays.
+        :return: None
+        """
+        x = self._stacks["x"]
+        swarm_best_x = np.empty_like(x)
+        history_best_x = np.empty_like(x)
+        params = np.empty((len(x), 4))
+        for swarm, start, end in zip(self.swarms, offsets[:-1], offsets[1:]):
+            swarm_best_x[start:end] = swarm.swarm_best_x
+            history_best_x[start:end] = random.choice(swarm.history_swarm_best_x)
+            params[start:end] = swarm.inertia_weight, swarm.phi1, swarm.phi2, swarm.phi3
+        u1, u2, u3 = np.random.uniform(0, 1, [3, len(x), 1]) * params.T[1:, :, None]
+        pso_step(x, self._stacks["v"], self._stacks["particle_best_x"], swarm_best_x, history_best_x,
+                 params[:, :1], u1, u2, u3)
+
+    def _next_step_and_evaluate_swarms(self):
+        """
+        Method that wraps the update of the particles position (next step) and the evaluation of
+        the fitness at these new positions for all swarms. The particles of all swarms are
+        updated, decoded and encoded in one batch.
+        :return: The swarms that are updated.
+        """
+        offsets = self._stack_swarms()
+        self._next_step_swarms(offsets)
+        x = self._stacks["x"]
+        smiles = self.infer_model.emb_to_seq(x)
+        x[:] = self.infer_model.seq_to_emb(smiles)
+        for swarm, start, end in zip(self.swarms, offsets[:-1], offsets[1:]):
+            swarm.smiles = smiles[start:end]
+        return self._update_fitness_swarms()
+
+    @property
+    def best_solutions(self):
+        """
+        Dataframe with the overall best solutions found over the course of the optimization,
+        sorted by fitness. Only rebuilt from the tracked solutions if they changed.
+        """
+        if self._best_solutions_df is None:
+            best_solutions = pd.DataFrame({
+                "smiles": pd.Series(list(self._best.keys()), dtype=object),
+                "fitness": pd.Series(list(self._best.values()), dtype=float),
+            })
+            best_solutions["residues"] = best_solutions["smiles"].map(self.smi_to_residues)
+            best_solutions["hashes"] = best_solutions["smiles"].map(self.smi_to_hashes)
+            self._best_solutions_df = best_solutions.sort_values(
+                "fitness", ascending=False, kind="stable").reset_index(drop=True)
+        return self._best_solutions_df
+
+    def _clean_best_heap(self):
+        """
+        Method that pops outdated entries (SMILES that were evicted or whose fitness improved)
+        from the top of the min-heap of the best solutions.
+        :return: None
+        """
+        heap = self._best_heap
+        while heap and self._best.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
 
-        best_solutions_max = self.best_solutions.fitness.max()
-        best_solutions_min = self.best_solutions.fitness.min()
-        best_solutions_mean = self.best_solutions.fitness.mean()
-        return best_solutions_max, best_solutions_min, best_solutions_mean
+    def _update_best_solutions(self, num_track):
+        """
+        Method that updates the best solutions that are tracked over the course of the
+        optimization. The fitness of the best solutions is kept in a dictionary keyed by SMILES
+        together with a min-heap, so the worst tracked solution can be evicted without sorting.
+        :param num_track: Number of best solutions to track.
+        :return: The max, min and mean fitness of the best solutions.
+        """
+        if num_track <= 0:
+            # nothing is tracked
+            return np.nan, np.nan, np.nan
+        changed = False
+        for swarm in self.swarms:
+            fitness = np.asarray(swarm.fitness, dtype=float)
+            if len(self._best) >= num_track:
+                # only particles fitter than the worst tracked solution can enter, so the
+                # remaining checks are only run on those
+                self._clean_best_heap()
+                candidates = np.flatnonzero(fitness > self._best_heap[0][0]).tolist()
+            else:
+                candidates = range(len(fitness))
+            for i in candidates:
+                smi, fit = swarm.smiles[i], float(fitness[i])
+                # NOTE: remove SMILES which match the SMILES used to initialise the particle swarms
+                if smi in self.init_smiles_set:
+                    continue
+                # a NaN would never compare as the worst solution and could not be evicted
+                if not math.isfinite(fit):
+                    continue
+                old = self._best.get(smi)
+                if old is not None:
+                    if fit <= old:
+                        continue
+                elif len(self._best) >= num_track:
+                    self._clean_best_heap()
+                    if fit <= self._best_heap[0][0]:
+                        continue
+                self._best[smi] = fit
+                heapq.heappush(self._best_heap, (fit, smi))
+                self._best_fitness_max = max(self._best_fitness_max, fit)
+                if len(self._best) > num_track:
+                    self._clean_best_heap()
+                    _, min_smi = heapq.heappop(self._best_heap)
+                    del self._best[min_smi]
+                changed = True
+
+        if changed:
+            self._best_solutions_df = None
+        if len(self._best_heap) > 2 * len(self._best) + 1000:
+            self._best_heap = [(fit, smi) for smi, fit in self._best.items()]
+            heapq.heapify(self._best_heap)
+        self._clean_best_heap()
+        if not self._best:
+            return np.nan, np.nan, np.nan
+        # exact sum, a running sum drifts and e.g. misses a mean fitness of exactly 1
+        mean_fitness = math.fsum(self._best.values()) / len(self._best)
+        return self._best_fitness_max, self._best_heap[0][0], mean_fitness
+
+    def _best_fitness_history_frame(self, start=0):
+        """
+        Method that builds a dataframe from the tracked best fitness history.
+        :param start: Index of the first history entry included.
+        :return: Dataframe with the history entries from start on.
+        """
+        history = pd.DataFrame({
+            "step": self._history_step[start:],
+            "swarm": self._history_swarm[start:],
+            "fitness": self._history_fitness[start:],
+            "smiles": self._history_smiles[start:],
+        })
+        history["residues"] = history["smiles"].map(self.smi_to_residues)
+        history["hashes"] = history["smiles"].map(self.smi_to_hashes)
+        return history
+
+    @property
+    def best_fitness_history(self):
+        """
+        Dataframe with the best solution of each swarm at each step. Only rebuilt from the
+        tracked history if it changed.
+        """
+        if self._best_fitness_history_df is None:
+            self._best_fitness_history_df = self._best_fitness_history_frame()
+        return self._best_fitness_history_df
 
     def _update_best_fitness_history(self, step):
         """
@@ -149,55 +436,64 @@ class BasePSOptimizer:
         :param step: The current iteration step of the optimizer.
         :return: None
         """
-        new_df = pd.DataFrame(columns=["step", "swarm", "fitness", "smiles", "residues", "hashes"])
-        new_df.fitness = [swarm.swarm_best_fitness for swarm in self.swarms]
-        new_df.smiles = [swarm.best_smiles for swarm in self.swarms]
-        new_df.residues = [self.smi_to_residues[str(smi)] for smi in new_df.smiles]  # need to str() as smi is a numpy string lol
-        new_df.hashes = [self.smi_to_hashes[str(smi)] for smi in new_df.smiles]
-
-        new_df.swarm = [i for i in range(len(self.swarms))]
-        new_df.step = step
-        # self.best_fitness_history = self.best_fitness_history.append(new_df, sort=False)
-        self.best_fitness_history = pd.concat([self.best_fitness_history, new_df], ignore_index=True, sort=False)
-
-    def run(self, num_steps: int, num_track: int = 1_000_000, out_dir: Path = Path("./results/")):
+        num_swarms = len(self.swarms)
+        self._history_step.extend([step] * num_swarms)
+        self._history_swarm.extend(range(num_swarms))
+        self._history_fitness.extend(float(swarm.swarm_best_fitness) for swarm in self.swarms)
+        self._history_smiles.extend(swarm.best_smiles for swarm in self.swarms)
+        self._best_fitness_history_df = None
+
+    def run(self, num_steps: int, num_track: int = 1_000_000, out_dir: Path = Path("./results/"),
+            checkpoint_every: int = 10):
         """
         The main optimization loop.
         :param num_steps: The number of update steps.
         :param num_track: Number of best solutions to track.
+        :param out_dir: Directory the results are written to.
+        :param checkpoint_every: Number of steps after which the best solutions and the scores are
+            saved and the new entries of the best fitness history are appended to its csv file.
         :return: The optimized particle swarm.
         """
         out_dir.mkdir(exist_ok=False, parents=True)
 
         # evaluate initial score
-        for swarm in self.swarms:
-            self.update_fitness(swarm)
+        self._update_fitness_swarms()
 
         # run particle swarm optimisation
-        with open(out_dir / "epoch_stats.txt", "a") as epoch_stats_file:
+        num_scores_saved = 0
+        num_history_saved = 0
+        with open(out_dir / "epoch_stats.txt", "a") as epoch_stats_file, \
+                open(out_dir / "best_fitness_history.csv", "w") as history_file:
             for step in tqdm(range(num_steps), desc="running steps"):
                 self._update_best_fitness_history(step)
+                checkpoint = (step + 1) % checkpoint_every == 0 or step == num_steps - 1
                 max_fitness, min_fitness, mean_fitness = self._update_best_solutions(num_track)
                 epoch_stats = f"Step {step:d}, max: {max_fitness:.3f}, min: {min_fitness:.3f}, mean: {mean_fitness:.3f}"
                 logger.success(epoch_stats)
                 epoch_stats_file.write(epoch_stats + "\n")
-                
-                for swarm in tqdm(self.swarms, desc="updating each swarm"):
-                    self._next_step_and_evaluate(swarm)
-                            
+
+                self._next_step_and_evaluate_swarms()
+
                 # save
-                self.best_solutions.to_csv(out_dir / "best_solutions.csv", index=False)
-                self.best_fitness_history.to_csv(out_dir / "best_fitness_history.csv", index=False)
-                mols2grid.save(
-                    self.best_solutions, 
-                    smiles_col="smiles", 
-                    output=out_dir / "generated_smiles_and_fitnesses_grid.html", 
-                    subset=["fitness"],
-                    tooltip=["smiles", "residues", "hashes"]
-                )
-                with open(out_dir / "smi_to_unscaled_scores.json", "w") as f:
+                if checkpoint:
+                    self.best_solutions.to_csv(out_dir / "best_solutions.csv", index=False)
+                    mols2grid.save(
+                        self.best_solutions, 
+                        smiles_col="smiles", 
+                        output=out_dir / "generated_smiles_and_fitnesses_grid.html", 
+                        subset=["fitness"],
+                        tooltip=["smiles", "residues", "hashes"]
+                    )
+                    history_df = self._best_fitness_history_frame(num_history_saved)
+                    history_df.to_csv(history_file, header=num_history_saved == 0, index=False)
+                    history_file.flush()
+                    num_history_saved = len(self._history_step)
                     # use this to speed up a future run, assuming oracle params like residues_of_interest are identical
-                    json.dump(self.smi_to_unscaled_scores, f, cls=NumpyEncoder)
+                    # only the scores added since the last checkpoint are appended, one {smiles: score} per line
+                    with open(out_dir / "smi_to_unscaled_scores.jsonl", "a") as f:
+                        new_scores = itertools.islice(self.smi_to_unscaled_scores.items(), num_scores_saved, None)
+                        f.writelines(json.dumps({smi: score}) + "\n" for smi, score in new_scores)
+                    num_scores_saved = len(self.smi_to_unscaled_scores)
         return self.swarms
 
     @classmethod
@@ -323,32 +619,35 @@ class BasePSOptimizer:
         ) for swarm_dict in swarm_dicts]
         return cls(swarms, inference_model, scoring_functions, **kwargs)
 
+    def close(self):
+        """
+        Shuts down the worker processes used for parsing SMILES.
+        :return: None
+        """
+        if self._parse_pool_finalizer is not None:
+            self._parse_pool_finalizer()
+        self._parse_pool = None
+        self._parse_pool_finalizer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def __getstate__(self):
-        """dont pickle all swarms --> faster serialization/multiprocessing"""
-        return {k: v for k, v in self.__dict__.items() if k not in ('swarms',)}
+        """dont pickle all swarms, their positions and worker pools --> faster serialization/multiprocessing"""
+        return {k: v for k, v in self.__dict__.items()
+                if k not in ('swarms', '_parse_pool', '_parse_pool_finalizer', '_stacks')}
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._parse_pool = None
+        self._parse_pool_finalizer = None
+        self._stacks = {}
 
-class ParallelSwarmOptimizer(BasePSOptimizer):
-    def _next_step_and_evaluate(self):
-        """
-        Method that wraps the update of the particles position (next step) and the evaluation of
-        the fitness at these new positions.
-        :param swarm: The swarm that is updated.
-        :return: The swarm that is updated.
-        """
-        num_part = self.swarms[0].num_part
-        emb = []
-        for swarm in self.swarms:
-            swarm.next_step()
-            emb.append(swarm.x)
-        emb = np.concatenate(emb)
-        smiles = self.infer_model.emb_to_seq(emb)
-        x = self.infer_model.seq_to_emb(smiles)
-        for i, swarm in enumerate(self.swarms):
-            swarm.smiles = smiles[i*num_part: (i+1)*num_part]
-            swarm.x = x[i*num_part: (i+1)*num_part]
-            swarm = self.update_fitness(swarm)
 
+class ParallelSwarmOptimizer(BasePSOptimizer):
     def run(self, num_steps, num_track=10):
         """
         The main optimization loop.
@@ -357,14 +656,13 @@ class ParallelSwarmOptimizer(BasePSOptimizer):
         :return: The optimized particle swarm.
         """
         # evaluate initial score
-        for swarm in self.swarms:
-            self.update_fitness(swarm)
+        self._update_fitness_swarms()
         for step in range(num_steps):
             self._update_best_fitness_history(step)
             max_fitness, min_fitness, mean_fitness = self._update_best_solutions(num_track)
             print("Step %d, max: %.3f, min: %.3f, mean: %.3f"
                   % (step, max_fitness, min_fitness, mean_fitness))
-            self._next_step_and_evaluate()
+            self._next_step_and_evaluate_swarms()
         return self.swarms, self.best_solutions
 
 
@@ -374,9 +672,11 @@ class MPPSOOptimizer(BasePSOptimizer):
     A PSOOptimizer class that uses multiprocessing to parallelize the optimization of multiple
     swarms. Only works if the inference_model is a instance of the inference_server class in the
     CDDD package that rolls out calculations on multiple zmq servers (possibly on multiple GPUs).
+    The workers get a copy of the optimizer state when the pool is first used, so the inference
+    model and scoring functions should not be replaced afterwards.
     """
     # TODO: this is different from the base class, as run() does no initial evaluation but got the evaluate query method.
-    def __init__(self, swarms, inference_model, scoring_functions=None, num_workers=1):
+    def __init__(self, swarms, inference_model, scoring_functions=None, num_workers=1, mp_context=None):
         """
         :param swarms: List of swarm objects each defining an individual particle swarm that is
             used for optimization.
@@ -386,14 +686,68 @@ class MPPSOOptimizer(BasePSOptimizer):
         :param scoring_functions: List of functions that are used to evaluate a generated molecule.
             Either take a RDKit mol object as input or a point in the cddd space.
         :param num_workers: Number of workers used for the multiprocessing.
+        :param mp_context: Multiprocessing context used to start the workers, e.g.
+            multiprocessing.get_context("forkserver"). Defaults to the platform default.
+            With spawn or forkserver the workers import the main module of the program, so its
+            module level code has to be guarded by `if __name__ == "__main__":`.
         """
         super().__init__(swarms, inference_model, scoring_functions)
         self.num_workers = num_workers
+        self.mp_context = mp_context
+        self._pool = None
+        self._pool_finalizer = None
+
+    def _get_pool(self):
+        """
+        Method that returns the worker pool. The pool is created on first use and reused
+        afterwards.
+        :return: The multiprocessing pool.
+        """
+        if self._pool is None:
+            ctx = self.mp_context if self.mp_context is not None else mp.get_context()
+            # the pool keeps its initargs, so pass a copy without swarms and pools instead of self
+            self._pool = ctx.Pool(self.num_workers, initializer=_init_worker, initargs=(copy.copy(self),))
+            # terminates the workers if the optimizer is collected (or at exit) without close()
+            self._pool_finalizer = weakref.finalize(self, self._pool.terminate)
+        return self._pool
+
+    def _map_swarms(self, method_name, *iterables):
+        """
+        Method that applies a method of the optimizer to each swarm in the worker pool.
+        :param method_name: Name of the method that takes a swarm (and additional arguments) and
+            returns the updated swarm.
+        :param iterables: Iterables with an additional argument of the method for each swarm.
+        :return: The updated swarms.
+        """
+        tasks = [(method_name, swarm, *args) for swarm, *args in zip(self.swarms, *iterables)]
+        return self._get_pool().starmap(_call_worker_optimizer, tasks)
+
+    def close(self):
+        """
+        Shuts down the worker pool and the worker processes used for parsing SMILES.
+        :return: None
+        """
+        if self._pool is not None:
+            self._pool_finalizer.detach()
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            self._pool_finalizer = None
+        super().close()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop('_pool', None)
+        state.pop('_pool_finalizer', None)
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._pool = None
+        self._pool_finalizer = None
 
     def evaluate_query(self):
-        pool = mp.Pool(self.num_workers)
-        self.swarms = pool.map(self.update_fitness, self.swarms)
-        pool.close()
+        self.swarms = self._map_swarms("update_fitness")
         return self.swarms
 
     def run(self, num_steps, num_track=500):
@@ -406,25 +760,21 @@ class MPPSOOptimizer(BasePSOptimizer):
             swarms: The optimized particle swarm.
             best_solutions: The best solutions found over the course of optimization.
         """
-        pool = mp.Pool(self.num_workers)
         for step in range(num_steps):
             start_time = time.time()
-            self.swarms = pool.map(self._next_step_and_evaluate, self.swarms)
+            self.swarms = self._map_swarms("_next_step_and_evaluate")
             end_time = time.time() - start_time
             max_fitness, min_fitness, mean_fitness = self._update_best_solutions(num_track)
             self._update_best_fitness_history(step)
             print("Step %d, max: %.3f, min: %.3f, mean: %.3f, et: %.1f s"
                   %(step, max_fitness, min_fitness, mean_fitness, end_time))
-            if (num_track == 1) & (self.best_solutions[:num_track].fitness.mean() == 1.):
-                break
-            elif self.best_solutions[:num_track].fitness.mean() == 1.:
+            if mean_fitness == 1.:
                 break
-        pool.close()
         return self.swarms, self.best_solutions
 
 class MPPSOOptimizerManualScoring(MPPSOOptimizer):
-    def __init__(self, swarms, inference_model, num_workers=1):
-        super().__init__(swarms, inference_model, num_workers=num_workers)
+    def __init__(self, swarms, inference_model, num_workers=1, mp_context=None):
+        super().__init__(swarms, inference_model, num_workers=num_workers, mp_context=mp_context)
 
     def _next_step_and_evaluate(self, swarm, fitness):
         """
@@ -440,7 +790,5 @@ class MPPSOOptimizerManualScoring(MPPSOOptimizer):
         return swarm
 
     def run_one_iteration(self, fitness):
-        pool = mp.Pool(self.num_workers)
-        self.swarms = pool.starmap(self._next_step_and_evaluate, zip(self.swarms, fitness))
-        pool.close()
+        self.swarms = self._map_swarms("_next_step_and_evaluate", fitness)
         return self.swarms
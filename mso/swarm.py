@@ -4,6 +4,41 @@ Module that defines the Swarm class used by the Particle Swarm Optimizer.
 import random
 import numpy as np
 
+
+def pso_step(x, v, particle_best_x, swarm_best_x, history_best_x, inertia_weight, u1, u2, u3):
+    """
+    Function that updates the velocities and positions of particles in place (one PSO step).
+    Used by Swarm.next_step as well as by the optimizer for the stacked particles of all swarms.
+    :param x: The positions of the particles (num_part, ndim).
+    :param v: The velocities of the particles (num_part, ndim).
+    :param particle_best_x: The best position of each particle.
+    :param swarm_best_x: The best position of the swarm of each particle.
+    :param history_best_x: A previous best position of the swarm of each particle.
+    :param inertia_weight: PSO hyperparamter (scalar or one per particle).
+    :param u1: Random weights of the particle best term (num_part, 1).
+    :param u2: Random weights of the swarm best term (num_part, 1).
+    :param u3: Random weights of the history best term (num_part, 1).
+    :return: None
+    """
+    # v = w * v + u1 * (particle_best_x - x) + u2 * (swarm_best_x - x) + u3 * (history_best_x - x)
+    # accumulated in place with a single buffer instead of a temporary array per term
+    v *= inertia_weight
+    v_u = np.empty_like(v)
+    for u, best_x in ((u1, particle_best_x), (u2, swarm_best_x), (u3, history_best_x)):
+        np.subtract(best_x, x, out=v_u)
+        v_u *= u
+        v += v_u
+    x += v
+    # x = np.clip(x, x_min, x_max)
+    # clip x by norm of latent vectors
+    # x /= np.linalg.norm(x, axis=1, keepdims=True)
+    # clip x to a hyperball of fixed radius R = 10
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    x *= np.minimum(norms, 10) / norms
+    # below projects to a hyperball of radius R = 10, which is not the same as clipping
+    # x = x / (np.linalg.norm(x, axis=1, keepdims=True) / 10)
+
+
 class Swarm:
     """
     Class that defines a Swarm that can be optimized by a PSOptimizer. Most PSO calculations are
@@ -42,9 +77,9 @@ class Swarm:
         self.fitness = np.zeros(self.num_part)
         self.swarm_best_x = np.copy(x)
         self.particle_best_x = np.copy(self.x)
-        self.history_swarm_best_x = [x]
+        self.history_swarm_best_x = [np.copy(x)]
         self.swarm_best_fitness = 0
-        self.particle_best_fitness = self.fitness
+        self.particle_best_fitness = np.copy(self.fitness)
         self.best_smiles = self.smiles[0]
 
     def next_step(self):
@@ -55,19 +90,9 @@ class Swarm:
         u1 = np.random.uniform(0, self.phi1, [self.num_part, 1])
         u2 = np.random.uniform(0, self.phi2, [self.num_part, 1])
         u3 = np.random.uniform(0, self.phi3, [self.num_part, 1])
-        v_u1 = u1 * (self.particle_best_x - self.x)
-        v_u2 = u2 * (self.swarm_best_x - self.x)
-        v_u3 = u3 * (np.array(random.choice(self.history_swarm_best_x)) - self.x)
-        self.v = self.inertia_weight * self.v + v_u1 + v_u2 + v_u3
-        self.x += self.v
-        # self.x = np.clip(self.x, self.x_min, self.x_max)
-        # clip x by norm of latent vectors
-        # self.x /= np.linalg.norm(self.x, axis=1, keepdims=True)
-        # clip x to a hyperball of fixed radius R = 10
-        norms = np.linalg.norm(self.x, axis=1, keepdims=True)
-        self.x *= np.minimum(norms, 10) / norms
-        # below projects to a hyperball of radius R = 10, which is not the same as clipping
-        # self.x = self.x / (np.linalg.norm(self.x, axis=1, keepdims=True) / 10)
+        history_best_x = np.asarray(random.choice(self.history_swarm_best_x))
+        pso_step(self.x, self.v, self.particle_best_x, self.swarm_best_x, history_best_x,
+                 self.inertia_weight, u1, u2, u3)
 
     def update_fitness(self, fitness):
         """
@@ -76,25 +101,19 @@ class Swarm:
         :param fitness: the fitness of each particle at the new position.
         :return: None
         """
-        self.fitness = fitness
-        best_idx = np.argmax(fitness)
-        best_fitness = fitness[best_idx]
+        # fitness and particle bests are updated in place, as they may be views into the
+        # stacked arrays of the optimizer
+        self.fitness[:] = fitness
+        best_idx = np.argmax(self.fitness)
+        best_fitness = self.fitness[best_idx]
         if best_fitness > self.swarm_best_fitness:
             self.history_swarm_best_x.append(np.copy(self.x[best_idx]))
             self.swarm_best_fitness = np.copy(best_fitness)
             self.swarm_best_x = np.copy(self.x[best_idx])
-            self.best_smiles = np.copy(self.smiles[best_idx])
-        self.particle_best_x = np.where(
-            np.expand_dims(fitness, 1) > np.expand_dims(self.particle_best_fitness, 1),
-            self.x.copy(),
-            self.particle_best_x
-        )
-
-        self.particle_best_fitness = np.where(
-            fitness > self.particle_best_fitness,
-            fitness,
-            self.particle_best_fitness
-        )
+            self.best_smiles = self.smiles[best_idx]
+        improved = self.fitness > self.particle_best_fitness
+        self.particle_best_x[improved] = self.x[improved]
+        self.particle_best_fitness[improved] = self.fitness[improved]
 
     def __repr__(self):
         return 'mso.swarm.Swarm num_part={} best_fitness={}'.format(self.num_part,
@@ -119,11 +138,12 @@ class Swarm:
         """
         particles = dictionary['particles']
         smiles = [particle['smiles'] for particle in particles]
-        dscore = np.array([particle['dscore'] for particle in particles])
+        dscore = np.array([particle['dscore'] for particle in particles], dtype=float)
         position = np.array([particle['x'] for particle in particles])
         velocity = np.array([particle['v'] for particle in particles])
         particle_best_x = np.array([particle['part_best_x'] for particle in particles])
-        particle_best_fitness = [particle['part_best_fitness'] for particle in particles]
+        particle_best_fitness = np.array([particle['part_best_fitness'] for particle in particles],
+                                         dtype=float)
         swarm = Swarm(
             smiles=smiles,
             x=position,
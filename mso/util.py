@@ -9,7 +9,16 @@ def canonicalize_smiles(sml):
     :param sml: input SMILES
     :return: The canonical version of the input SMILES
     """
+    return parse_smiles(sml)[0]
+
+def parse_smiles(sml):
+    """
+    Function that parses a given SMILES and canonicalizes it
+    :param sml: input SMILES
+    :return: The canonical version of the input SMILES and its RDKit mol object (None if the
+        SMILES could not be parsed)
+    """
     mol = Chem.MolFromSmiles(sml)
     if mol is not None:
         sml = Chem.MolToSmiles(mol)
-    return sml
\ No newline at end of file
+    return sml, mol
\ No newline at end of file